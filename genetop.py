@@ -1,70 +1,7 @@
 import streamlit as st
 import pandas as pd
-import requests
-
-# --- Pharos API 호출 함수 ---
-def get_pharos_data(gene_symbols):
-    url = 'https://pharos-api.ncats.io/graphql'
-    results = {}
-    query = """
-    query getTarget($gene: String!) {
-      target(q: { sym: $gene }) {
-        sym, name, tdl, fam, uniprot
-        publications(top: 10) { pmid, title, journal, date }
-      }
-    }
-    """
-    for gene in gene_symbols:
-        variables = {'gene': gene}
-        try:
-            response = requests.post(url, json={'query': query, 'variables': variables}, timeout=10)
-            if response.status_code == 200:
-                resp_json = response.json()
-                target_data = resp_json.get('data', {}).get('target')
-                results[gene] = target_data if target_data else {'error': 'No data found'}
-            else:
-                results[gene] = {'error': f'HTTP {response.status_code}'}
-        except Exception as e:
-            results[gene] = {'error': str(e)}
-    return results
-
-# --- Open Targets API 호출 함수 ---
-def get_opentargets_data(uniprot_id):
-    if not uniprot_id: return None
-    url = "https://api.platform.opentargets.org/api/v4/graphql"
-    query = """
-    query targetByUniprot($uId: [String!]!) {
-      mapIds(queryTerms: $uId) {
-        mappings { hits { object { ... on Target { id, approvedSymbol
-                knownDrugs { count, rows { drug { name }, phase, status } }
-                associatedDiseases { count } } } } } }
-    }
-    """
-    variables = {"uId": [uniprot_id]}
-    try:
-        response = requests.post(url, json={'query': query, 'variables': variables}, timeout=10)
-        if response.status_code == 200:
-            res_json = response.json()
-            mappings = res_json.get('data', {}).get('mapIds', {}).get('mappings', [])
-            if mappings and mappings[0].get('hits'):
-                return mappings[0]['hits'][0].get('object')
-    except: pass
-    return None
-
-# --- AlphaFold API 호출 함수 ---
-def get_alphafold_pdb(uniprot_id):
-    if not uniprot_id: return None, None
-    api_url = f"https://alphafold.ebi.ac.uk/api/prediction/{uniprot_id}"
-    try:
-        response = requests.get(api_url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                pdb_url = data[0].get('pdbUrl')
-                pdb_content = requests.get(pdb_url).content
-                return pdb_url, pdb_content
-    except: pass
-    return None, None
+import httpx
+from pharos_api import parse_gene_input, get_pharos_data, get_target_details, download_pdb
 
 # --- Streamlit UI 설정 ---
 st.set_page_config(page_title="Biobytes Target Analyzer", layout="wide")
@@ -81,35 +18,50 @@ input_text = st.text_input("유전자 기호 입력 (예: ETS2, EGFR) 쉼표로
 # 버튼 클릭 시에만 API 호출 후 세션 상태에 저장
 if st.button("데이터 분석 및 PDB 찾기"):
     if input_text:
-        gene_list = [g.strip().upper() for g in input_text.split(",") if g.strip()]
+        gene_list = parse_gene_input(input_text)
         with st.spinner('데이터 분석 중...'):
             # API 데이터를 가져와서 세션에 저장
-            st.session_state.analysis_results = get_pharos_data(gene_list)
+            pharos_info = get_pharos_data(gene_list)
+            # UniProt ID가 없는 유전자는 Open Targets / AlphaFold 조회 대상에서 제외
+            found = {gene: info['uniprot'] for gene, info in pharos_info.items() if 'error' not in info and info.get('uniprot')}
+            # Open Targets / AlphaFold는 세션에 아직 없거나 이전 조회가 실패한 유전자만 모아서 동시에 호출
+            # (값이 None이어도 조회에 성공한 경우는 데이터가 없는 것이므로 다시 호출하지 않음)
+            missing = {gene: uniprot for gene, uniprot in found.items()
+                       if f'ot_{gene}' not in st.session_state or st.session_state.get(f'failed_{gene}')}
+            if missing:
+                details, failed = get_target_details(tuple(missing), tuple(missing.values()))
+                for gene, (ot_data, pdb_url) in details.items():
+                    st.session_state[f'ot_{gene}'] = ot_data
+                    st.session_state[f'pdb_{gene}'] = pdb_url
+                    st.session_state[f'failed_{gene}'] = gene in failed
+                if failed:
+                    st.warning("일부 Open Targets / AlphaFold 정보를 가져오지 못했습니다. 다시 시도해 주세요.")
+            st.session_state.analysis_results = pharos_info
     else:
         st.warning("유전자 기호를 입력해 주세요.")
 
 # 세션에 데이터가 있을 경우 화면에 표시 (버튼 클릭 여부와 상관없이 유지됨)
 if st.session_state.analysis_results:
     pharos_info = st.session_state.analysis_results
-    summary_data = []
     valid_genes = []
 
     for gene, info in pharos_info.items():
         if info and 'error' not in info:
-            summary_data.append({
-                "Gene Symbol": gene,
-                "Full Name": info.get('name'),
-                "TDL": info.get('tdl'),
-                "Family": info.get('fam'),
-                "UniProt ID": info.get('uniprot')
-            })
             valid_genes.append(gene)
         else:
             st.error(f"**{gene}**: 데이터를 찾을 수 없습니다.")
 
-    if summary_data:
+    if valid_genes:
+        # 행 단위 dict 대신 열 단위 list로 DataFrame 생성
+        summary_df = pd.DataFrame({
+            "Gene Symbol": valid_genes,
+            "Full Name": [pharos_info[g].get('name') for g in valid_genes],
+            "TDL": [pharos_info[g].get('tdl') for g in valid_genes],
+            "Family": [pharos_info[g].get('fam') for g in valid_genes],
+            "UniProt ID": [pharos_info[g].get('uniprot') for g in valid_genes],
+        })
         st.subheader("📊 분석 요약 결과")
-        st.dataframe(pd.DataFrame(summary_data), use_container_width=True)
+        st.dataframe(summary_df, use_container_width=True)
         st.divider()
 
         # 이제 여기서 다른 유전자를 선택해도 데이터가 사라지지 않습니다.
@@ -119,9 +71,9 @@ if st.session_state.analysis_results:
             info = pharos_info[selected_gene]
             uniprot_id = info.get('uniprot')
             
-            # 상세 정보 로딩 (캐싱 가능)
-            ot_data = get_opentargets_data(uniprot_id)
-            pdb_url, pdb_content = get_alphafold_pdb(uniprot_id)
+            # 분석 시 세션에 저장해 둔 상세 정보 사용 (탭 전환 등 rerun 시 네트워크 호출 없음)
+            ot_data = st.session_state.get(f'ot_{selected_gene}')
+            pdb_url = st.session_state.get(f'pdb_{selected_gene}')
 
             st.markdown(f"### 🧬 {selected_gene} 통합 리포트")
             
@@ -137,7 +89,11 @@ if st.session_state.analysis_results:
                     st.metric("질병 연관성", f"{ot_data.get('associatedDiseases', {}).get('count', 0)} 건")
                     st.metric("알려진 약물", f"{ot_data.get('knownDrugs', {}).get('count', 0)} 건")
 
-            tab1, tab2, tab3 = st.tabs(["📚 최근 관련 논문", "💊 약물 현황", "🔬 AlphaFold PDB"])
+            if uniprot_id:
+                tab1, tab2, tab3 = st.tabs(["📚 최근 관련 논문", "💊 약물 현황", "🔬 AlphaFold PDB"])
+            else:
+                st.warning("UniProt ID가 없어 약물 현황과 AlphaFold 구조는 조회하지 않았습니다.")
+                tab1, = st.tabs(["📚 최근 관련 논문"])
             
             with tab1:
                 st.subheader("최근 관련 논문 (Top 10)")
@@ -148,29 +104,40 @@ if st.session_state.analysis_results:
                         st.markdown(f"- **({date_str})** {pub['title']}  \n  *Journal: {pub['journal']}* | [PMID: {pub['pmid']}](https://pubmed.ncbi.nlm.nih.gov/{pub['pmid']}/)")
                 else: st.info("관련 논문 정보가 없습니다.")
 
-            with tab2:
-                st.subheader("약물 및 임상 현황")
-                if ot_data and ot_data.get('knownDrugs', {}).get('count', 0) > 0:
-                    drugs = ot_data['knownDrugs']['rows']
-                    drug_df = pd.DataFrame([
-                        {"Drug Name": d['drug']['name'], "Phase": d['phase'], "Status": d['status']}
-                        for d in drugs[:10]
-                    ])
-                    st.table(drug_df)
-                else: st.info("알려진 약물 정보가 없습니다.")
-
-            with tab3:
-                st.subheader("AlphaFold 구조 데이터")
-                if pdb_url:
-                    st.success(f"PDB 파일을 찾았습니다: [링크]({pdb_url})")
-                    st.download_button(
-                        label=f"{selected_gene} PDB 다운로드",
-                        data=pdb_content,
-                        file_name=f"AF_{selected_gene}_{uniprot_id}.pdb",
-                        mime="application/octet-stream",
-                        key=f"dl_{selected_gene}"
-                    )
-                else: st.error("AlphaFold PDB 정보를 찾을 수 없습니다.")
+            if uniprot_id:
+                with tab2:
+                    st.subheader("약물 및 임상 현황")
+                    if ot_data and ot_data.get('knownDrugs', {}).get('count', 0) > 0:
+                        rows = ot_data['knownDrugs']['rows'][:10]
+                        drug_df = pd.DataFrame({
+                            "Drug Name": [r['drug']['name'] for r in rows],
+                            "Phase": [r['phase'] for r in rows],
+                            "Status": [r['status'] for r in rows],
+                        })
+                        st.table(drug_df)
+                    else: st.info("알려진 약물 정보가 없습니다.")
+
+                with tab3:
+                    st.subheader("AlphaFold 구조 데이터")
+                    if pdb_url:
+                        st.success(f"PDB 파일을 찾았습니다: [링크]({pdb_url})")
+                        # PDB 파일은 용량이 크므로 버튼을 눌렀을 때만 내려받음 (다운로드 버튼 클릭 후에도 유지)
+                        ready_key = f"pdb_ready_{selected_gene}"
+                        if st.button("PDB 파일 준비", key=f"prep_{selected_gene}"):
+                            st.session_state[ready_key] = True
+                        if st.session_state.get(ready_key):
+                            try:
+                                st.download_button(
+                                    label=f"{selected_gene} PDB 다운로드",
+                                    data=download_pdb(pdb_url),
+                                    file_name=f"AF_{selected_gene}_{uniprot_id}.pdb",
+                                    mime="application/octet-stream",
+                                    key=f"dl_{selected_gene}"
+                                )
+                            except httpx.HTTPError:
+                                st.session_state[ready_key] = False
+                                st.error("PDB 파일을 내려받지 못했습니다.")
+                    else: st.error("AlphaFold PDB 정보를 찾을 수 없습니다.")
 
 st.divider()
 st.caption("Integrated by Biobytes | Data from Pharos, Open Targets & AlphaFold DB")
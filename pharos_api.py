@@ -0,0 +1,365 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import random
+import threading
+import time
+import streamlit as st
+import httpx
+import orjson
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+# --- GraphQL 쿼리 (호출마다 다시 만들지 않도록 모듈 상수로 정의) ---
+PHAROS_URL = 'https://pharos-api.ncats.io/graphql'
+# 이름/계열/논문 목록은 요약만 보여주는 화면에서는 필요 없으므로 $detailed 플래그로 제외할 수 있음
+# (sym은 요청한 유전자 기호와 같으므로 받지 않음)
+PHAROS_TARGET_FIELDS = "tdl uniprot ...@include(if:$detailed){name fam publications(top:10){pmid title journal date}}"
+
+OT_URL = "https://api.platform.opentargets.org/api/v4/graphql"
+OT_MAPPING_FIELDS = (
+    "mappings { hits { object { ... on Target {"
+    " knownDrugs(size: 10) { count rows { drug { name } phase status } }"
+    " associatedDiseases { count } } } } }"
+)
+
+# GraphQL 요청 본문은 orjson으로 바로 bytes로 인코딩해서 전송
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# 디스크 캐시 (앱을 재시작해도 유지, 7일 후 만료)
+DISK_CACHE_DIR = "./.pharos_cache"
+DISK_CACHE_EXPIRE = 7 * 86400
+# PDB 파일은 더 오래 보관하되, 7일이 지나면 ETag/Last-Modified로 서버에 변경 여부만 확인
+PDB_CACHE_EXPIRE = 30 * 86400
+PDB_REVALIDATE_AFTER = DISK_CACHE_EXPIRE
+
+# Pharos에 해당 유전자가 없을 때의 오류 메시지 (요청 실패와 구분)
+PHAROS_NOT_FOUND = 'No data found'
+
+# Open Targets / AlphaFold 조회 하나당 최대 대기 시간 (초)
+FETCH_TIMEOUT = 30
+
+# --- HTTP 클라이언트 (rerun과 상관없이 앱 프로세스 전체에서 재사용) ---
+# Pharos / Open Targets / AlphaFold API와 PDB 파일 다운로드 모두 하나의 AsyncClient로 처리
+class _RetryTransport(httpx.AsyncBaseTransport):
+    # 429/5xx 응답은 Retry-After 헤더(없으면 지수 backoff + jitter)만큼 기다린 뒤 다시 요청하고,
+    # 호스트별 동시 요청 수를 제한해 API 호출 한도를 넘지 않도록 함
+    # 재시도 대기는 retry_budget 안에서만 하므로 호출하는 쪽의 timeout(FETCH_TIMEOUT)을 넘지 않음
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    def __init__(self, transport, attempts=5, max_per_host=64, retry_budget=20):
+        self._transport = transport
+        self._attempts = attempts
+        self._max_per_host = max_per_host
+        self._retry_budget = retry_budget
+        self._semaphores = {}
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return int(retry_after)
+        return min(0.5 * 2 ** attempt, 30) + random.random()
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self._max_per_host)
+        deadline = time.monotonic() + self._retry_budget
+        async with self._semaphores[host]:
+            for attempt in range(1, self._attempts + 1):
+                response = await self._transport.handle_async_request(request)
+                if response.status_code not in self.RETRY_STATUS or attempt == self._attempts:
+                    return response
+                delay = self._retry_delay(response, attempt)
+                if delay > deadline - time.monotonic():
+                    # 남은 시간 안에 다시 요청할 수 없으면 (긴 Retry-After 등) 마지막 응답을 그대로 반환
+                    return response
+                await response.aclose()
+                logger.info("HTTP %s from %s, retrying (%d/%d)", response.status_code, host, attempt, self._attempts - 1)
+                await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+@st.cache_resource
+def _get_event_loop():
+    # AsyncClient의 연결은 이벤트 루프에 묶이므로 전용 루프를 백그라운드 스레드에서 계속 실행
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+@st.cache_resource
+def get_async_client():
+    # HTTP/2로 같은 호스트에 대한 동시 요청을 하나의 연결에서 다중화 (풀은 호스트별로 관리됨)
+    # 연결 단계 오류는 transport에서 최대 3번, 일시적인 429/5xx 응답은 _RetryTransport에서 최대 5번까지 재시도
+    transport = _RetryTransport(httpx.AsyncHTTPTransport(
+        http2=True, retries=3,
+        # 사용자가 결과를 보는 동안에도 연결이 끊기지 않도록 keep-alive 유지 시간을 늘림
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60),
+    ))
+    # HTTP/2에서는 Connection 헤더를 쓸 수 없으므로 압축 관련 헤더만 지정
+    return httpx.AsyncClient(
+        transport=transport, timeout=15, follow_redirects=True,
+        headers={'Accept-Encoding': 'gzip, deflate, br'},
+    )
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+# --- 디스크 캐시 ---
+@st.cache_resource
+def get_disk_cache():
+    return diskcache.Cache(DISK_CACHE_DIR)
+
+def _cache_key(kind, value):
+    return f"{kind}:{hashlib.sha1(value.encode()).hexdigest()}"
+
+# --- 부분 실패 결과 ---
+class PartialResult(Exception):
+    # st.cache_data는 예외를 캐시하지 않으므로, 일부 조회가 실패한 결과는 예외에 담아서 꺼냄
+    def __init__(self, result):
+        super().__init__("lookup partially failed")
+        self.result = result
+
+# --- 입력 처리 ---
+def parse_gene_input(text):
+    # 쉼표로 구분된 입력을 대문자로 정규화하고, 순서는 유지하면서 중복(예: EGFR, egfr)을 제거
+    return list(dict.fromkeys(g.strip().upper() for g in text.split(",") if g.strip()))
+
+# --- Pharos API 호출 함수 ---
+# 쿼리 문서는 유전자 개수에만 의존하므로 (유전자 기호는 변수로 전달) 개수별로 한 번만 생성
+@functools.lru_cache(maxsize=64)
+def _pharos_query(count):
+    params = ",".join(["$detailed:Boolean!"] + [f"$g{i}:String!" for i in range(count)])
+    selections = " ".join(f"g{i}:target(q:{{sym:$g{i}}}){{{PHAROS_TARGET_FIELDS}}}" for i in range(count))
+    return f"query getTargets({params}){{{selections}}}"
+
+async def _post_pharos(client, gene_symbols, timeout, detailed=True):
+    # 유전자마다 요청하지 않고 alias(g0, g1, ...)로 묶어서 한 번에 조회
+    variables = {f"g{i}": gene for i, gene in enumerate(gene_symbols)}
+    variables['detailed'] = detailed
+    body = orjson.dumps({'query': _pharos_query(len(gene_symbols)), 'variables': variables})
+    response = await client.post(PHAROS_URL, content=body, headers=JSON_HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+# 같은 유전자 조합은 하루 동안 네트워크 호출 없이 캐시에서 반환
+# (GraphQL 오류가 있거나 data가 비어 있는 응답은 PartialResult로 꺼내서 캐시되지 않음)
+@st.cache_data(ttl=86400, show_spinner=False)
+def _query_pharos(gene_symbols, detailed):
+    # 여러 유전자를 한 번에 조회하므로 timeout을 넉넉하게 설정
+    body = run_async(_post_pharos(get_async_client(), gene_symbols, timeout=30, detailed=detailed))
+    if body.get('data') is None or body.get('errors'): raise PartialResult(body)
+    return body
+
+def _graphql_error(errors):
+    # GraphQL 오류는 PHAROS_NOT_FOUND와 구분해서 조회 실패로 처리 (캐시되지 않음)
+    return {'error': "GraphQL error: " + ("; ".join(str(err.get('message', err)) for err in errors) or "no data")}
+
+async def _fetch_one(client, gene, detailed):
+    try:
+        body = await _post_pharos(client, [gene], timeout=10, detailed=detailed)
+        if body.get('errors'): return _graphql_error(body['errors'])
+        return (body.get('data') or {}).get('g0') or {'error': PHAROS_NOT_FOUND}
+    except httpx.HTTPStatusError as e:
+        return {'error': f'HTTP {e.response.status_code}'}
+    except Exception as e:
+        return {'error': str(e)}
+
+async def _fetch_each(client, gene_symbols, detailed):
+    responses = await asyncio.gather(*(_fetch_one(client, gene, detailed) for gene in gene_symbols))
+    return dict(zip(gene_symbols, responses))
+
+def _lookup_pharos(gene_symbols, detailed):
+    try:
+        body = _query_pharos(tuple(gene_symbols), detailed)
+    except PartialResult as e:
+        body = e.result
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        # 유전자가 하나뿐이면 개별 요청도 같은 요청이므로 다시 보내지 않고 오류를 반환
+        if len(gene_symbols) == 1:
+            error = f'HTTP {e.response.status_code}' if isinstance(e, httpx.HTTPStatusError) else str(e)
+            return {gene_symbols[0]: {'error': error}}
+        body = {}
+    data = body.get('data')
+    errors = body.get('errors') or []
+    if len(gene_symbols) == 1 and (errors or data is None):
+        return {gene_symbols[0]: _graphql_error(errors)}
+    if data is None:
+        # 묶음 요청 자체가 실패하면 유전자별 요청으로 나눠서 동시에 다시 시도
+        return run_async(_fetch_each(get_async_client(), gene_symbols, detailed))
+    results = {gene: data.get(f"g{i}") or {'error': PHAROS_NOT_FOUND} for i, gene in enumerate(gene_symbols)}
+    # errors[].path에 나온 alias는 (publications 같은 필드 하나만 비어 있어도) 해당 유전자만 개별 요청으로 다시 조회
+    # path가 없는 오류는 어느 유전자의 것인지 알 수 없으므로 모든 유전자를 다시 조회
+    failed_aliases = {err['path'][0] for err in errors if err.get('path')}
+    retry = [gene for i, gene in enumerate(gene_symbols)
+             if f"g{i}" in failed_aliases or any(not err.get('path') for err in errors)]
+    if retry:
+        results.update(run_async(_fetch_each(get_async_client(), retry, detailed)))
+    return results
+
+def get_pharos_data(gene_symbols, detailed=True):
+    gene_symbols = list(dict.fromkeys(gene_symbols))
+    if not gene_symbols: return {}
+    # 유전자별로 디스크 캐시를 먼저 확인하고, 없는 유전자만 묶어서 조회
+    cache = get_disk_cache()
+    keys = {gene: _cache_key('pharos', f"{gene}:{int(detailed)}") for gene in gene_symbols}
+    results = {gene: cache.get(keys[gene]) for gene in gene_symbols}
+    pending = [gene for gene, info in results.items() if info is None]
+    if pending:
+        for gene, info in _lookup_pharos(pending, detailed).items():
+            results[gene] = info
+            if 'error' not in info:
+                cache.set(keys[gene], info, expire=DISK_CACHE_EXPIRE)
+    return results
+
+# --- Open Targets API 호출 함수 ---
+@functools.lru_cache(maxsize=64)
+def _ot_query(count):
+    params = ", ".join(f"$u{i}: [String!]!" for i in range(count))
+    selections = "\n".join(f"m{i}: mapIds(queryTerms: $u{i}) {{ {OT_MAPPING_FIELDS} }}" for i in range(count))
+    return f"query targetsByUniprot({params}) {{\n{selections}\n}}"
+
+async def get_opentargets_data(client, uniprot_ids):
+    results = {}
+    if not uniprot_ids: return results
+    # Pharos와 마찬가지로 UniProt ID마다 alias(m0, m1, ...)를 붙여 한 번에 조회
+    variables = {f"u{i}": [uniprot_id] for i, uniprot_id in enumerate(uniprot_ids)}
+    body = orjson.dumps({'query': _ot_query(len(uniprot_ids)), 'variables': variables})
+    # 요청 실패는 빈 결과와 구분되도록 예외를 그대로 올려 보냄 (_fetch_all에서 처리)
+    try:
+        response = await client.post(OT_URL, content=body, headers=JSON_HEADERS, timeout=15)
+        response.raise_for_status()
+        data = orjson.loads(response.content).get('data') or {}
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.warning("Open Targets request failed: %s", e)
+        raise
+    for i, uniprot_id in enumerate(uniprot_ids):
+        mappings = (data.get(f"m{i}") or {}).get('mappings', [])
+        if mappings and mappings[0].get('hits'):
+            results[uniprot_id] = mappings[0]['hits'][0].get('object')
+    return results
+
+# --- AlphaFold API 호출 함수 ---
+# 분석 단계에서는 PDB 링크만 확인하고, 파일은 사용자가 요청할 때 download_pdb로 받음
+async def get_alphafold_meta(client, uniprot_id):
+    if not uniprot_id: return None
+    api_url = f"https://alphafold.ebi.ac.uk/api/prediction/{uniprot_id}"
+    try:
+        # pdbUrl은 최신 모델 버전을 가리키는 prediction API 응답을 그대로 사용
+        # 404는 예측 구조가 없다는 뜻이므로 None, 그 밖의 실패는 예외로 올려 보냄
+        response = await client.get(api_url, timeout=10)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.warning("AlphaFold request failed for %s: %s", uniprot_id, e)
+        raise
+    if data and len(data) > 0:
+        return data[0].get('pdbUrl')
+    return None
+
+async def _download_pdb(client, pdb_url, cached=None):
+    # 캐시된 파일이 있으면 조건부 요청을 보내고, 304면 본문 없이 기존 파일을 그대로 사용
+    headers = {}
+    if cached and cached.get('etag'): headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+    async with client.stream('GET', pdb_url, headers=headers, timeout=20) as response:
+        if response.status_code == 304 and cached:
+            return {**cached, 'fetched_at': time.time()}
+        response.raise_for_status()
+        content = b"".join([chunk async for chunk in response.aiter_bytes(64 * 1024)])
+    return {
+        'content': content,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    }
+
+# AlphaFold PDB 파일은 디스크 캐시에 저장해 앱을 재시작해도 재사용
+@st.cache_data(ttl=86400, max_entries=64, show_spinner=False)
+def download_pdb(pdb_url):
+    cache = get_disk_cache()
+    key = _cache_key('pdb', pdb_url)
+    entry = cache.get(key)
+    if not isinstance(entry, dict): entry = None
+    if entry is None:
+        entry = run_async(_download_pdb(get_async_client(), pdb_url))
+        cache.set(key, entry, expire=PDB_CACHE_EXPIRE)
+    elif time.time() - entry['fetched_at'] > PDB_REVALIDATE_AFTER:
+        # 재검증에 실패해도 (네트워크 오류, 5xx 등) 이미 받아둔 파일은 그대로 제공
+        try:
+            entry = run_async(_download_pdb(get_async_client(), pdb_url, entry))
+            cache.set(key, entry, expire=PDB_CACHE_EXPIRE)
+        except httpx.HTTPError as e:
+            logger.warning("PDB revalidation failed for %s, serving cached file: %s", pdb_url, e)
+    return entry['content']
+
+# --- Open Targets / AlphaFold 동시 호출 ---
+def _read_cached_urls(cache, uniprots):
+    return {u: cache.get(_cache_key('alphafold', u)) for u in uniprots}
+
+def _write_cached_urls(cache, pdb_urls):
+    for u, url in pdb_urls.items():
+        cache.set(_cache_key('alphafold', u), url, expire=DISK_CACHE_EXPIRE)
+
+async def _with_timeout(coro, seconds):
+    async with asyncio.timeout(seconds):
+        return await coro
+
+async def _fetch_all(client, cache, genes, uniprots):
+    # Open Targets는 묶음 요청 한 번, AlphaFold는 UniProt ID별 요청을 모두 동시에 실행
+    lookup = [u for u in dict.fromkeys(uniprots) if u]
+    # AlphaFold pdbUrl은 디스크 캐시에 있으면 다시 조회하지 않음
+    # (이벤트 루프는 모든 세션이 공유하므로 디스크 I/O는 별도 스레드에서 처리)
+    pdb_urls = await asyncio.to_thread(_read_cached_urls, cache, lookup)
+    af_lookup = [u for u in lookup if pdb_urls[u] is None]
+    # timeout은 작업마다 따로 걸어서, 한 호스트가 느려도 이미 받은 다른 결과는 버리지 않음
+    ot_data, *af_results = await asyncio.gather(
+        _with_timeout(get_opentargets_data(client, lookup), FETCH_TIMEOUT),
+        *(_with_timeout(get_alphafold_meta(client, u), FETCH_TIMEOUT) for u in af_lookup),
+        return_exceptions=True,
+    )
+    # 조회에 실패한(timeout 포함) 유전자를 같이 반환해서 결과가 캐시되지 않도록 함
+    # (Open Targets는 묶음 요청이라 실패하면 모든 유전자가 실패로 처리됨)
+    failed_uniprots = {u for u, url in zip(af_lookup, af_results) if isinstance(url, BaseException)}
+    if isinstance(ot_data, BaseException):
+        ot_data = {}
+        failed_uniprots.update(lookup)
+    failed = frozenset(gene for gene, u in zip(genes, uniprots) if u in failed_uniprots)
+    fetched = {u: url for u, url in zip(af_lookup, af_results) if url and not isinstance(url, BaseException)}
+    if fetched:
+        pdb_urls.update(fetched)
+        await asyncio.to_thread(_write_cached_urls, cache, fetched)
+    return {gene: (ot_data.get(u), pdb_urls.get(u)) for gene, u in zip(genes, uniprots)}, failed
+
+# 같은 유전자/UniProt 조합은 모든 조회가 성공했을 때만 하루 동안 캐시에서 반환
+@st.cache_data(ttl=86400, show_spinner=False)
+def _get_target_details(genes, uniprots):
+    details, failed = run_async(_fetch_all(get_async_client(), get_disk_cache(), list(genes), list(uniprots)))
+    if failed: raise PartialResult((details, failed))
+    return details
+
+# (details, failed)를 반환 — failed는 조회에 실패해서 값이 비어 있는 유전자 집합
+def get_target_details(genes, uniprots):
+    try:
+        return _get_target_details(genes, uniprots), frozenset()
+    except PartialResult as e:
+        return e.result
+
+# --- 전체 파이프라인 (Pharos 묶음 조회 → Open Targets / AlphaFold 동시 조회) ---
+# (results, complete)를 반환 — 요청 실패나 timeout이 있었으면 complete는 False
+def fetch_all(gene_list, detailed=True):
+    results = get_pharos_data(gene_list, detailed)
+    complete = all(info.get('error', PHAROS_NOT_FOUND) == PHAROS_NOT_FOUND for info in results.values())
+    found = {gene: info['uniprot'] for gene, info in results.items() if 'error' not in info and info.get('uniprot')}
+    if not found: return results, complete
+    details, failed = get_target_details(tuple(found), tuple(found.values()))
+    if failed:
+        logger.warning("Open Targets / AlphaFold lookup failed for %s", ", ".join(sorted(failed)))
+    for gene, (ot_data, pdb_url) in details.items():
+        results[gene] = {**results[gene], 'opentargets': ot_data, 'pdb_url': pdb_url}
+    return results, complete and not failed
@@ -1,72 +1,40 @@
+import html
 import streamlit as st
-import requests
 import pandas as pd
-import io
+from pharos_api import PartialResult, fetch_all, parse_gene_input
 
-def get_pharos_data(gene_symbols):
-    url = 'https://pharos-api.ncats.io/graphql'
-    results = {}
+# --- 분석 파이프라인 ---
+RESULT_COLUMNS = ["Gene", "IDG Level", "UniProt ID", "AF PDB Link"]
 
-    # 1. 쿼리 수정: q 대신 직접 sym으로 검색하거나 facet 활용
-    # 2. properties 대신 더 직접적인 명칭 사용
-    query = """
-    query getTarget($gene: String!) {
-      target(q: { sym: $gene }) {
-        sym
-        tdl
-        uniprot  # Pharos 스키마에서 uniprot은 보통 직접 호출 가능합니다.
-      }
-    }
-    """
-
-    for gene in gene_symbols:
-        variables = {'gene': gene}
-        try:
-            response = requests.post(url, json={'query': query, 'variables': variables}, timeout=10)
-            
-            if response.status_code == 200:
-                resp_json = response.json()
-                
-                # 에러 메시지가 있는지 확인
-                if 'errors' in resp_json:
-                    print(f"Error for {gene}: {resp_json['errors'][0]['message']}")
-                    continue
-                
-                target_data = resp_json.get('data', {}).get('target')
-                if target_data:
-                    results[gene] = {
-                        'tdl': target_data.get('tdl'),
-                        'uniprot': target_data.get('uniprot')
-                    }
-                else:
-                    print(f"No data found for {gene}")
-            else:
-                print(f"HTTP Error {response.status_code} for {gene}")
-        except Exception as e:
-            print(f"Exception for {gene}: {str(e)}")
-            continue
-            
-    return results
-
-# --- 2. AlphaFold API: PDB 파일 링크 및 데이터 가져오기 ---
-def get_alphafold_pdb(uniprot_id):
-    if not uniprot_id:
-        return None, None
+# 같은 유전자 조합이면 입력 순서와 상관없이 (정렬된 tuple을 key로) 1시간 동안 결과를 재사용
+# 요청 실패나 timeout이 섞인 결과는 캐시하지 않아서 버튼을 다시 누르면 다시 조회함
+@st.cache_data(ttl=3600, show_spinner=False)
+def _analyze(gene_tuple):
+    # 이 화면은 IDG 단계와 UniProt ID만 쓰므로 상세 필드(이름/계열/논문)는 제외하고 조회
+    pharos_info, complete = fetch_all(list(gene_tuple), detailed=False)
+    
+    final_results = []
     
-    # AlphaFold API 호출
-    api_url = f"https://alphafold.ebi.ac.uk/api/prediction/{uniprot_id}"
+    for gene in gene_tuple:
+        info = pharos_info.get(gene, {})
+        tdl = info.get('tdl', 'Not Found')
+        uniprot_id = info.get('uniprot')
+        pdb_url = info.get('pdb_url')
+        
+        final_results.append({
+            "Gene": gene,
+            "IDG Level": tdl,
+            "UniProt ID": uniprot_id if uniprot_id else "N/A",
+            "AF PDB Link": pdb_url if pdb_url else "Not Found"
+        })
+    if not complete: raise PartialResult(final_results)
+    return final_results
+
+def analyze(gene_tuple):
     try:
-        response = requests.get(api_url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if data and len(data) > 0:
-                pdb_url = data[0].get('pdbUrl')
-                # 실제 PDB 파일 내용 다운로드
-                pdb_content = requests.get(pdb_url).content
-                return pdb_url, pdb_content
-    except:
-        pass
-    return None, None
+        return _analyze(gene_tuple), True
+    except PartialResult as e:
+        return e.result, False
 
 # --- Streamlit UI 설정 ---
 st.set_page_config(page_title="Biobytes Target Analyzer", layout="wide")
@@ -78,48 +46,41 @@ input_text = st.text_input("유전자 기호 입력 (예: ETS2, EGFR)", placehol
 
 if st.button("데이터 분석 및 PDB 찾기"):
     if input_text:
-        gene_list = [g.strip().upper() for g in input_text.split(",") if g.strip()]
+        gene_list = parse_gene_input(input_text)
         
         with st.spinner('데이터를 통합 분석 중입니다...'):
-            pharos_info = get_pharos_data(gene_list)
-            
-            final_results = []
-            
-            for gene in gene_list:
-                info = pharos_info.get(gene, {'tdl': 'Not Found', 'uniprot': None})
-                tdl = info['tdl']
-                uniprot_id = info['uniprot']
-                
-                pdb_url, pdb_content = get_alphafold_pdb(uniprot_id)
-                
-                final_results.append({
-                    "Gene": gene,
-                    "IDG Level": tdl,
-                    "UniProt ID": uniprot_id if uniprot_id else "N/A",
-                    "AF PDB Link": pdb_url if pdb_url else "Not Found",
-                    "pdb_content": pdb_content
-                })
+            # 결과는 사용자가 입력한 순서대로 다시 정렬해서 표시
+            records, complete = analyze(tuple(sorted(gene_list)))
+            records = {r["Gene"]: r for r in records}
+            final_results = [records[gene] for gene in gene_list]
+            if not complete:
+                st.warning("일부 데이터를 가져오지 못했습니다. 잠시 후 다시 시도해 주세요.")
 
             # 테이블 표시
-            df = pd.DataFrame(final_results).drop(columns=['pdb_content'])
+            # 레코드에는 표시할 열만 들어 있으므로 열 목록을 지정해 그대로 DataFrame으로 변환
+            df = pd.DataFrame.from_records(final_results, columns=RESULT_COLUMNS)
             st.subheader("📊 분석 결과 요약")
             st.table(df)
 
-            # 다운로드 섹션
+            # 클릭하기 전에 브라우저가 AlphaFold 연결을 미리 열어두도록 힌트 추가
+            # (PDB 파일은 수 MB라 모두 prefetch하지 않고, 첫 번째 파일만 미리 받아둠)
+            pdb_links = [r["AF PDB Link"] for r in final_results if r["AF PDB Link"] != "Not Found"]
+            if pdb_links:
+                st.markdown(
+                    '<link rel="preconnect" href="https://alphafold.ebi.ac.uk">'
+                    f'<link rel="prefetch" href="{html.escape(pdb_links[0], quote=True)}">',
+                    unsafe_allow_html=True,
+                )
+
+            # 다운로드 섹션 (PDB 파일은 서버에서 받아두지 않고 브라우저가 AlphaFold에서 직접 내려받음)
             st.subheader("📥 PDB 구조 파일 다운로드")
             cols = st.columns(len(final_results))
             
             for idx, item in enumerate(final_results):
                 with cols[idx]:
                     st.write(f"**{item['Gene']}**")
-                    if item['pdb_content']:
-                        st.download_button(
-                            label=f"Download PDB",
-                            data=item['pdb_content'],
-                            file_name=f"AF_{item['Gene']}_{item['UniProt ID']}.pdb",
-                            mime="application/octet-stream",
-                            key=f"btn_{idx}"
-                        )
+                    if item['AF PDB Link'] != "Not Found":
+                        st.link_button("Download PDB", url=item['AF PDB Link'])
                     else:
                         st.error("PDB 없음")
     else: